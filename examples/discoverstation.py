@@ -1,13 +1,23 @@
 # Discovers stations in the local network
+import asyncio
 import ipaddress
 import socket
+import struct
 
-from multiprocessing import Pool
-from synscan.comm import comm
 from synscan.motors import motors
 
 GOOGLE_DNS_IP_ADDRESS = "8.8.8.8"
 TCP_PORT = 80
+SYNSCAN_UDP_PORT = 11880
+# Kernel neighbour (ARP) cache. Linux only
+ARP_TABLE = "/proc/net/arp"
+ARP_FLAG_COMPLETE = 0x2
+# Max number of hosts probed at the same time. None: all of them in one window
+BATCH_SIZE = None
+
+# Same control msg used by comm.test_comm: asks if the mount is initialized
+PROBE_MESSAGE = b":F3\r"
+PROBE_RESPONSE = b"=\r"
 
 
 def get_self_interface():
@@ -17,21 +27,84 @@ def get_self_interface():
         return ipaddress.ip_interface(self_ip)
 
 
-def is_synscan_device(ip_address, timeout_seconds=2):
+def get_network_hosts(network):
+    '''Host addresses of network as strings. No IPv4Address is built per host'''
+    first = int(network.network_address) + 1
+    last = int(network.broadcast_address)
+    return [socket.inet_ntoa(struct.pack('!I', i)) for i in range(first, last)]
+
+
+def get_arp_candidates(network):
+    '''Hosts of network already known (alive) by the kernel ARP cache'''
+    try:
+        with open(ARP_TABLE) as f:
+            # Skip header line
+            lines = f.readlines()[1:]
+    except OSError:
+        return []
+    candidates = []
+    for line in lines:
+        fields = line.split()
+        if int(fields[2], 16) & ARP_FLAG_COMPLETE and ipaddress.ip_address(fields[0]) in network:
+            candidates.append(fields[0])
+    return candidates
+
+
+class SynscanProbe(asyncio.DatagramProtocol):
+    '''Send the probe to all the hosts (address strings) at once and collect the ones answering'''
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.bases = set()
+        # Hosts not answered yet. Done when all of them have answered
+        self.pending = set(hosts)
+        self.done = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        for host in self.hosts:
+            transport.sendto(PROBE_MESSAGE, (host, SYNSCAN_UDP_PORT))
+
+    def datagram_received(self, data, addr):
+        if data == PROBE_RESPONSE:
+            self.bases.add(ipaddress.ip_address(addr[0]))
+        self.pending.discard(addr[0])
+        if not self.pending and not self.done.done():
+            self.done.set_result(True)
+
+
+async def scan(hosts, timeout_seconds, batch_size=BATCH_SIZE):
+    '''Probe hosts in batches of batch_size. Each batch has its own timeout window.
+    batch_size=None probes all the hosts in a single window'''
+    if not batch_size:
+        return await scan_batch(hosts, timeout_seconds)
+    bases = set()
+    for first in range(0, len(hosts), batch_size):
+        bases |= await scan_batch(hosts[first:first + batch_size], timeout_seconds)
+    return bases
+
+
+async def scan_batch(hosts, timeout_seconds):
+    loop = asyncio.get_running_loop()
+    transport, probe = await loop.create_datagram_endpoint(
+        lambda: SynscanProbe(hosts), local_addr=('0.0.0.0', 0), allow_broadcast=True)
     try:
-        c = comm(str(ip_address))
-        c.timeout_seconds = timeout_seconds
-        return c.test_comm()
-    except:
-        return False
+        # All hosts share the same timeout window. Stop waiting if all of them answer
+        await asyncio.wait([probe.done], timeout=timeout_seconds)
+    finally:
+        transport.close()
+    return probe.bases
 
 
-def find_synscan_bases(pool_size=254):
-    p = Pool(pool_size)
-    hosts = list(get_self_interface().network.hosts())
-    base_flags = p.map(is_synscan_device, hosts)
-    p.close()
-    return [ip_address for ip_address, is_base in zip(hosts, base_flags) if is_base]
+def find_synscan_bases(timeout_seconds=2, batch_size=BATCH_SIZE):
+    network = get_self_interface().network
+    # Broadcast probe and live hosts (bases not answering to broadcast) share one window
+    hosts = [str(network.broadcast_address)] + get_arp_candidates(network)
+    bases = asyncio.run(scan(hosts, timeout_seconds, batch_size))
+    # Sweep the whole network if no base is found
+    if not bases:
+        hosts = get_network_hosts(network)
+        bases = asyncio.run(scan(hosts, timeout_seconds, batch_size))
+    return sorted(bases)
 
 
 if __name__ == '__main__':
@@ -44,4 +117,3 @@ if __name__ == '__main__':
         smc.goto(30, 30, syncronous=True)
         # Return to original position and exit without wait
         smc.goto(0, 0, syncronous=False)
-
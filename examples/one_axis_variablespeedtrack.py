@@ -4,23 +4,22 @@ import time
 smc=synscan.motors()
 
 AXIS=2
-#FORWARD
-#RAMP UP
-for speed in range(0,50,1):
-    time.sleep(.1)
-    smc.axis_track(AXIS,speed/10)
-#RAMP DOWN
-for speed in range(50,0,-1):
-    time.sleep(.1)
-    smc.axis_track(AXIS,speed/10)
+STEP_NS=100000000   #0.1s
 
+#SPEED PROFILE
+#FORWARD: RAMP UP and RAMP DOWN
+profile=[speed/10 for speed in range(0,50,1)]+[speed/10 for speed in range(50,0,-1)]
 #BACKWARDS
-#RAMP UP
-for speed in range(0,50,1):
-    time.sleep(.1)
-    smc.axis_track(AXIS,-speed/10)
-#RAMP DOWN
-for speed in range(50,0,-1):
-    time.sleep(.1)
-    smc.axis_track(AXIS,-speed/10)
+profile=profile+[-speed for speed in profile]
 
+next_ns=time.monotonic_ns()
+for speed in profile:
+    #Sleep until the step time so command latency doesn't accumulate
+    next_ns+=STEP_NS
+    delay_ns=next_ns-time.monotonic_ns()
+    if delay_ns>0:
+        time.sleep(delay_ns/1e9)
+    else:
+        #Late. Restart the schedule instead of sending the missed steps in a burst
+        next_ns=time.monotonic_ns()
+    smc.axis_track(AXIS,speed)
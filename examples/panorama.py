@@ -1,4 +1,5 @@
 import time
+import itertools
 import synscan
 
 smc=synscan.motors()
@@ -7,9 +8,9 @@ smc=synscan.motors()
 smc.set_pos(0,0)
 
 #define a grid and walk over his points
-for az in range(0,180,30):
-    for alt in range(0,90,30):
-        smc.goto(az,alt,syncronous=True)    #Goto and wait to finish
-        smc.set_switch(True)                #Activate camera with the integrate switch
-        time.sleep(2)
-        smc.set_switch(False)
+grid=list(itertools.product(range(0,180,30),range(0,90,30)))
+for az,alt in grid:
+    smc.goto(az,alt,syncronous=True)    #Goto and wait to finish
+    smc.set_switch(True)                #Activate camera with the integrate switch
+    time.sleep(2)
+    smc.set_switch(False)
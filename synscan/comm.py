@@ -6,15 +6,32 @@
 
 import socket
 import logging
+import binascii
 import os
-import select
+import selectors
 import threading
+import contextlib
 
 UDP_IP = os.getenv("SYNSCAN_UDP_IP", "192.168.4.1")
 UDP_PORT = os.getenv("SYNSCAN_UDP_PORT", 11880)
 
 LOGGING_LEVEL = os.getenv("SYNSCAN_LOGGING_LEVEL", logging.ERROR)
 
+# Already built msgs of commands with no data or up to 1 byte of data.
+# Their number is small and they are the most sent ones (inquiries, start, stop, switch..)
+_CMD_CACHE = dict()
+
+# Msg prefix (':' + cmd + axis) of each command. Used for commands with 24 bits data
+_CMD_PREFIXES = dict()
+
+# First char (as int) of the responses
+RESPONSE_OK = 0x3D  # '='
+RESPONSE_ERROR = 0x21  # '!'
+
+# Error codes of '!' responses
+ERROR_CODES = {0: 'UnknownCommand', 1: 'CommandLengthError', 2: 'MotorNotStopped', 3: 'InvalidCharacter',
+               4: 'NotInitialized', 5: 'DriverSleeping', 7: 'PECTrainingIsRunning', 8: 'NoValidPECdata'}
+
 
 class comm:
     '''
@@ -22,72 +39,145 @@ class comm:
     Virtual. Used as base class. All members are protected
     '''
 
-    def __init__(self, udp_ip=UDP_IP, udp_port=UDP_PORT):
-        ''' Init the UDP socket '''
+    def __init__(self, udp_ip=UDP_IP, udp_port=UDP_PORT, thread_safe=True):
+        ''' Init the UDP socket.
+        Set thread_safe=False to skip locking when used from a single thread '''
 
         logging.basicConfig(
             format='%(asctime)s %(levelname)s:synscanComm %(message)s',
             level=LOGGING_LEVEL
         )
-        logging.info(f"UDP target IP: {udp_ip}")
-        logging.info(f"UDP target port: {udp_port}")
+        logging.info("UDP target IP: %s", udp_ip)
+        logging.info("UDP target port: %s", udp_port)
         self._sock = socket.socket(socket.AF_INET,  # Internet
                                    socket.SOCK_DGRAM)  # UDP
         self._sock.setblocking(0)
+        # Registered once. Avoids rebuilding the fd sets on every command
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._sock, selectors.EVENT_READ)
+        # Reused receive buffer. Responses are ~10 bytes long
+        self._rxbuf = bytearray(64)
+        self._rxview = memoryview(self._rxbuf)
         self.udp_ip = udp_ip
         self.udp_port = udp_port
+        # sendto destination. Port may come as a string from the environment
+        self._addr = (udp_ip, int(udp_port))
         self.commOK = False
-        self.lock = threading.Lock()
+        self.lock = threading.Lock() if thread_safe else contextlib.nullcontext()
         self.timeout_in_seconds = 2
 
+    def close(self):
+        '''Release the UDP socket '''
+        self._selector.close()
+        self._sock.close()
+
     def _send_raw_cmd(self, cmd):
         '''Low level send command function '''
         with self.lock:
-            self._sock.sendto(cmd, (self.udp_ip, self.udp_port))
-            ready = select.select([self._sock], [], [], self.timeout_in_seconds)
-            if ready[0]:
-                self.commOK = True
-                response, (fromhost, fromport) = self._sock.recvfrom(1024)
-                logging.debug(f"response: {response} host:{fromhost} port:{fromport}")
-            else:
-                self.commOK = False
-                logging.debug(f"Socket timeout. {self.timeout_in_seconds}s without response")
-                raise (NameError('SynscanSocketTimeoutError'))
-                response = False
+            self._drain()
+            self._sock.sendto(cmd, self._addr)
+            response = self._recv_response()
         return response
 
-    def _send_cmd(self, cmd, axis, data=None, ndigits=6):
-        '''Command function '''
+    def _send_raw_cmds(self, cmds):
+        '''Low level pipelined send command function.
+        All cmds are sent before waiting for any response.
+        Responses are returned in the same order as cmds '''
+        with self.lock:
+            self._drain()
+            for cmd in cmds:
+                self._sock.sendto(cmd, self._addr)
+            responses = [self._recv_response() for cmd in cmds]
+        return responses
+
+    def _drain(self):
+        '''Discard late responses (arrived after a timeout) still queued in the socket.
+        Responses are matched by order, so one of them would offset all the next ones.
+        Lock has to be held by the caller '''
+        while True:
+            try:
+                nbytes = self._sock.recv_into(self._rxbuf)
+            except BlockingIOError:
+                return
+            logging.warning("Discarding late response: %s", bytes(self._rxview[:nbytes]))
+
+    def _recv_response(self):
+        '''Wait for one response. Lock has to be held by the caller '''
+        ready = self._selector.select(self.timeout_in_seconds)
+        if ready:
+            self.commOK = True
+            nbytes, (fromhost, fromport) = self._sock.recvfrom_into(self._rxbuf)
+            response = bytes(self._rxview[:nbytes])
+            logging.debug("response: %s host:%s port:%s", response, fromhost, fromport)
+        else:
+            self.commOK = False
+            logging.debug("Socket timeout. %ss without response", self.timeout_in_seconds)
+            raise (NameError('SynscanSocketTimeoutError'))
+        return response
+
+    def _build_cmd(self, cmd, axis, data=None, ndigits=6):
+        '''Build the raw msg for a command '''
         if data is None:
             ndigits = 0
-        msg = bytes(f':{cmd}{axis}{self._int2hex(data, ndigits)}\r', 'utf-8')
-        logging.debug(f'sending cmd:{msg}')
-        raw_response = self._send_raw_cmd(msg)
-
+        if ndigits > 2:
+            prefix = _CMD_PREFIXES.get((cmd, axis))
+            if prefix is None:
+                prefix = _CMD_PREFIXES[(cmd, axis)] = bytes(f':{cmd}{axis}', 'utf-8')
+            return prefix + self._int2hex(data, ndigits).encode('utf-8') + b'\r'
+        key = (cmd, axis, data, ndigits)
+        msg = _CMD_CACHE.get(key)
+        if msg is None:
+            msg = _CMD_CACHE[key] = bytes(f':{cmd}{axis}{self._int2hex(data, ndigits)}\r', 'utf-8')
+        return msg
+
+    def _parse_response(self, msg, raw_response):
+        '''Decode the raw response to msg. Raise NameError if the mount returns an error.
+        Returns an int, or None for responses without data '''
+        # Most set commands just acknowledge without data
+        if raw_response == b'=\r':
+            return None
+        header = raw_response[0]
+        # Data between the header and '\r'. A view, not a copy
+        data = memoryview(raw_response)[1:-1]
         # If everything is OK first char must be '=' (code 61)
-        if raw_response[0] == 61:
-            response = self._hex2int(raw_response[1:-1])
+        if header == RESPONSE_OK:
+            response = self._hex2int(data)
             return response
 
         # If something goes wrong first char must be '!' (code 33)
-        if raw_response[0] == 33:
-            ErrorDict = {0: 'UnknownCommand', 1: 'CommandLengthError', 2: 'MotorNotStopped', 3: 'InvalidCharacter',
-                         4: 'NotInitialized', 5: 'DriverSleeping', 7: 'PECTrainingIsRunning', 8: 'NoValidPECdata'}
-            errorNumber = self._hex2int(raw_response[1:-1])
-            if errorNumber not in [0, 1, 2, 3, 4, 5, 7, 8]:
-                logging.warning(f'Unknown Error {raw_response}')
+        if header == RESPONSE_ERROR:
+            errorNumber = self._hex2int(data)
+            if errorNumber not in ERROR_CODES:
+                logging.warning('Unknown Error %s', raw_response)
                 raise (NameError('CMDUnknowError'))
                 return False
-            errorStr = ErrorDict[errorNumber]
-            logging.warning(f'CMD:{msg} Error:{errorStr} {raw_response}')
+            errorStr = ERROR_CODES[errorNumber]
+            logging.warning('CMD:%s Error:%s %s', msg, errorStr, raw_response)
             raise (NameError(errorStr))
             return False
         # Catch the rest
         else:
-            logging.warning(f'Unknown Error {raw_response}')
+            logging.warning('Unknown Error %s', raw_response)
             raise (NameError('CMDUnknowError'))
             return False
 
+    def _send_cmd(self, cmd, axis, data=None, ndigits=6):
+        '''Command function '''
+        msg = self._build_cmd(cmd, axis, data, ndigits)
+        logging.debug('sending cmd:%s', msg)
+        raw_response = self._send_raw_cmd(msg)
+        return self._parse_response(msg, raw_response)
+
+    def _send_cmds(self, cmds):
+        '''Pipelined command function.
+        cmds is a list of (cmd, axis[, data[, ndigits]]) tuples. All of them are sent
+        at once and the responses are returned in the same order. Useful to command
+        both axes paying only one round-trip '''
+        msgs = [self._build_cmd(*cmd) for cmd in cmds]
+        logging.debug('sending cmds:%s', msgs)
+        raw_responses = self._send_raw_cmds(msgs)
+        return [self._parse_response(msg, raw_response) for msg, raw_response in zip(msgs, raw_responses)]
+
     def _int2hex(self, data, ndigits=6):
         ''' Convert data prior to send to the motors following 
             Synscan Motor Protocol rules
@@ -101,21 +191,14 @@ class comm:
         '''
 
         assert (ndigits in [0, 1, 2, 4, 6]), "ndigits must be one of [0,2,4,6]"
-        if ndigits == 6:
-            strData = f'{data:06X}'
-        if ndigits == 4:
-            strData = f'{data:04X}'
-        if ndigits == 2:
-            strData = f'{data:02X}'
-        if ndigits == 1:
-            strData = f'{data:01X}'
         if ndigits == 0:
-            strData = f''
-        length = len(strData)
-        strHEX = ''
-        for i in range(length, 0, -2):
-            strHEX = strHEX + f'{strData[i - 2:i]}'
-        logging.debug(f'{data}(decimal) => {strData}(hex) => {strHEX}(synscan hex)')
+            return ''
+        # Single digit. Nothing to reorder
+        if ndigits == 1:
+            return f'{data:01X}'
+        # The synscan order is the little endian byte order
+        strHEX = data.to_bytes(ndigits // 2, 'little').hex().upper()
+        logging.debug('%s(decimal) => %s(synscan hex)', data, strHEX)
         return strHEX
 
     def _hex2int(self, data):
@@ -129,38 +212,33 @@ class comm:
         * 8 bits Data Sample: For HEX number 0x12, in the data segment of a command or
           response, it is sent/received in this order: "1" "2".
         '''
-        strData = data.decode("utf-8")
-        length = len(strData)
-        assert (length <= 6), f"Max allow value is FFFFFF. Actual={strData}"
+        # Data is any bytes-like object (bytes or a memoryview of the response).
+        # It is never decoded to str
+        length = len(data)
+        assert (length <= 6), f"Max allow value is FFFFFF. Actual={bytes(data)}"
         # Special cases
         # Some commands dont return data
         if length == 0:
-            return ''
-        # Status msg only return 12 bits (1.5bytes or 3 hex digits)
+            return None
+        # Status msg only return 12 bits (1.5bytes or 3 hex digits).
+        # They are digits, not bytes, so they are kept in order: "ABC" => 0xABC
         if length == 3:
-            logging.debug(f'3bytes response. Not converting to init. Returning as it as string')
-            return strData
+            return int(bytes(data), 16)
+        # Error codes are a single hex digit. Nothing to reorder
+        if length == 1:
+            return int(bytes(data), 16)
         # General case. Returned msd has 1,2,3 bytes (2,4 or 6 hex digits)
-        logging.debug(f'Converting {strData} to a integer')
-        strHEX = ''
-        for i in range(length, 0, -2):
-            strHEX = strHEX + f'{strData[i - 2:i]}'
-        v = int(strHEX, 16)
-        logging.debug(f'{strData}(synscan hex) => {strHEX}(hex) => {v}(decimal)')
+        # in little endian byte order
+        v = int.from_bytes(binascii.unhexlify(data), 'little')
+        # Raw response is already logged by _recv_response
+        logging.debug('synscan hex => %s(decimal)', v)
         return v
 
     def test_comm(self):
         '''Control msg to check comms'''
         MESSAGE = b":F3\r"
-        logging.info(f"Testing comms. Asking if initialized..")
+        logging.info("Testing comms. Asking if initialized..")
         response = self._send_raw_cmd(MESSAGE)
         is_ok = response == b'=\r'
-        logging.info(f"Mount initialized: {is_ok}.")
+        logging.info("Mount initialized: %s.", is_ok)
         return is_ok
-
-
-if __name__ == '__main__':
-    smc = comm()
-    smc._int2hex(smc._hex2int(b'1FCA89'))
-    smc._int2hex(smc._hex2int(b'5F3A'), 4)
-    smc._int2hex(smc._hex2int(b'B8'), 2)
@@ -6,14 +6,35 @@
 
 import os
 import logging
-from synscan.comm import comm
+import functools
+from synscan.comm import comm, UDP_IP, UDP_PORT
 import time
 
-UDP_IP = os.getenv("SYNSCAN_UDP_IP", "192.168.4.1")
-UDP_PORT = os.getenv("SYNSCAN_UDP_PORT", 11880)
-
 LOGGING_LEVEL = os.getenv("SYNSCAN_LOGGING_LEVEL", logging.WARNING)
 
+# Mount axes (1=azimuth/alpha, 2=altitude/beta)
+AXES = (1, 2)
+
+# Status msg HEX digit1 decoded as (Tracking, CCW, FastSpeed), indexed by its 3 low bits
+_STATUS_MODE_TABLE = tuple((bool(A & 0x01), bool(A & 0x02), bool(A & 0x04)) for A in range(8))
+
+
+@functools.lru_cache(maxsize=None)
+def _decode_status_items(status):
+    '''Decoded status msg as a tuple of (key, value) pairs. See motors._decode_status'''
+    A = (status >> 8) & 0xF
+    B = (status >> 4) & 0xF
+    C = status & 0xF
+    logging.debug('Decode status %03X A:%s B:%s C:%s', status, A, B, C)
+    tracking, ccw, fastSpeed = _STATUS_MODE_TABLE[A & 0x07]
+    return (('Tracking', tracking),
+            ('CCW', ccw),
+            ('FastSpeed', fastSpeed),
+            ('Stopped', not (B & 0x01)),
+            ('Blocked', bool(B & 0x02)),
+            ('InitDone', not (C & 0x01)),
+            ('LevelSwitchOn', bool(B & 0x02)))
+
 
 class motors(comm):
     '''
@@ -54,26 +75,67 @@ class motors(comm):
 
     '''
 
-    def __init__(self, udp_ip=UDP_IP, udp_port=UDP_PORT):
-        '''Init UDP comunication '''
+    # Seconds a status msg is reused before asking the mount again
+    _STATUS_TTL = 0.05
+
+    # Inquiry cmd of each parameter/value. Shared and read only. See get_values
+    _PARAMETER_CMDS = {'countsPerRevolution': 'a',
+                       'TimerInterruptFreq': 'b',
+                       'StepPeriod': 'i',
+                       'MotorBoardVersion': 'e',
+                       'HighSpeedRatio': 'g',
+                       }
+    _CURRENT_VALUE_CMDS = {'GotoTarget': 'h',
+                           'Position': 'j',
+                           'StepPeriod': 'i',
+                           'Status': 'f'
+                           }
+
+    def __init__(self, udp_ip=UDP_IP, udp_port=UDP_PORT, thread_safe=True):
+        '''Init UDP comunication. See comm '''
         logging.basicConfig(
             format='%(asctime)s %(levelname)s:synscanMotor: %(message)s',
             level=LOGGING_LEVEL
         )
-        super(motors, self).__init__(udp_ip, udp_port)
+        super(motors, self).__init__(udp_ip, udp_port, thread_safe)
+        self._statusCache = dict()
         self._init()
         self.update_current_values()
 
     def _init(self):
         '''Get main motor parameters. Retry if comm fails'''
         retrySec = 2
-        try:
-            self.params = self.get_parameters()
-        except NameError as error:
-            logging.warning(error)
-            logging.warning(f'Retriying in {retrySec}..')
-            time.sleep(retrySec)
-            self._init()
+        while True:
+            try:
+                self.params = self.get_parameters()
+                self._set_conversion_factors()
+                return
+            except NameError as error:
+                logging.warning(error)
+                logging.warning('Retriying in %s..', retrySec)
+                time.sleep(retrySec)
+
+    def _set_conversion_factors(self):
+        '''Precompute counts<->degrees factors so conversions are a single multiplication'''
+        self._countsPerDegree = dict()
+        self._degreesPerCount = dict()
+        for axis in self.params:
+            CPR = self.params[axis]['countsPerRevolution']
+            self._countsPerDegree[axis] = CPR / 360
+            self._degreesPerCount[axis] = 360 / CPR
+
+    def _send_cmd(self, cmd, axis, data=None, ndigits=6):
+        '''Command function. Set commands (upper case) invalidate the axis status cache'''
+        if cmd.isupper():
+            self._statusCache.pop(axis, None)
+        return super(motors, self)._send_cmd(cmd, axis, data, ndigits)
+
+    def _send_cmds(self, cmds):
+        '''Pipelined command function. Set commands (upper case) invalidate the axis status cache'''
+        for cmd in cmds:
+            if cmd[0].isupper():
+                self._statusCache.pop(cmd[1], None)
+        return super(motors, self)._send_cmds(cmds)
 
     def _degreesPerSecond2T1preset(self, axis, degreesPerSecond):
         countsPerSecond = self.degrees2counts(axis, degreesPerSecond)
@@ -92,15 +154,15 @@ class motors(comm):
         Used by get_parameters and update_current_values functions
 
         '''
+        # All the inquiries are sent pipelined. One round-trip instead of one per value
+        try:
+            values = iter(self._send_cmds([(cmd, axis) for axis in AXES for cmd in parameterDict.values()]))
+        except NameError as error:
+            logging.warning(error)
+            raise (NameError('getValuesError'))
         params = dict()
-        for axis in range(1, 3):
-            params[axis] = dict()
-            for parameter, cmd in parameterDict.items():
-                try:
-                    params[axis][parameter] = self._send_cmd(cmd, axis)
-                except NameError as error:
-                    logging.warning(error)
-                    raise (NameError('getValuesError'))
+        for axis in AXES:
+            params[axis] = {parameter: next(values) for parameter in parameterDict}
         return params
 
     def get_parameters(self):
@@ -118,35 +180,29 @@ class motors(comm):
             * HighSpeedRatio
 
         '''
-        parameterDict = {'countsPerRevolution': 'a',
-                         'TimerInterruptFreq': 'b',
-                         'StepPeriod': 'i',
-                         'MotorBoardVersion': 'e',
-                         'HighSpeedRatio': 'g',
-                         }
         try:
-            params = self.get_values(parameterDict)
+            params = self.get_values(self._PARAMETER_CMDS)
         except NameError as error:
             logging.warning(error)
             raise (NameError('getParametersError'))
             return {}
-        logging.info(f'MOUNT PARAMETERS: {params}')
+        logging.info('MOUNT PARAMETERS: %s', params)
         return params
 
     def axis_get_pos(self, axis):
         '''Get actual position in Degrees.'''
         counts = self.axis_get_posCounts(axis)
-        return self.counts2degrees(counts)
+        return self.counts2degrees(axis, counts)
 
     def axis_set_pos(self, axis, degrees):
         '''Syncronize position Degrees.'''
-        logging.info(f'AXIS{axis}: Syncronizing actual position to {degrees} degrees')
+        logging.info('AXIS%s: Syncronizing actual position to %s degrees', axis, degrees)
         counts = self.degrees2counts(axis, degrees)
         response = self.axis_set_posCounts(axis, int(counts))
 
-    def _decode_status(self, hexstring):
+    def _decode_status(self, status):
         ''' Decode Status msg.
-        Status msg is 12bits long (3 HEX digits). 
+        Status msg is 12bits long (3 HEX digits). It is received as an int (0xABC for "ABC")
         
         HEX digit1 bits:
 
@@ -175,19 +231,8 @@ class motors(comm):
         * LevelSwitchOn
 
         '''
-        A = int(hexstring[0], 16)
-        B = int(hexstring[1], 16)
-        C = int(hexstring[2], 16)
-        logging.debug(f'Decode status {hexstring} A:{A} B:{B} C:{C}')
-        status = dict()
-        status['Tracking'] = bool(A & 0x01)
-        status['CCW'] = bool((A & 0x02) >> 1)
-        status['FastSpeed'] = bool((A & 0x04) >> 2)
-        status['Stopped'] = not (B & 0x01)
-        status['Blocked'] = bool((B & 0x02) >> 1)
-        status['InitDone'] = not (C & 0x01)
-        status['LevelSwitchOn'] = bool((B & 0x02) >> 1)
-        return status
+        # Each call gets its own dict. Decoding is done once per different status msg
+        return dict(_decode_status_items(status))
 
     def axis_set_motion_mode(self, axis, Tracking, CW=True, fastSpeed=False):
         '''Set Motion Mode.
@@ -211,6 +256,14 @@ class motors(comm):
            * B2: 0=Normal Goto,1=Coarse Goto
 
         '''
+        value = self._motion_mode_value(Tracking, CW, fastSpeed)
+        # Send as two HEX digits
+        logging.info('AXIS%s: Setting Motion Mode: %s HEX:%02X', axis, value, value)
+        response = self._send_cmd('G', axis, value, ndigits=2)
+        return response
+
+    def _motion_mode_value(self, Tracking, CW, fastSpeed):
+        '''Motion mode msg value. See axis_set_motion_mode'''
         if not Tracking:
             if fastSpeed:
                 speedBit = 0
@@ -225,15 +278,11 @@ class motors(comm):
             value = 16
         else:
             value = 0
-        value = value + speedBit * 32 + CW
-        # Send as two HEX digits
-        logging.info(f'AXIS{axis}: Setting Motion Mode: {value} HEX:{value:02X}')
-        response = self._send_cmd('G', axis, value, ndigits=2)
-        return response
+        return value + speedBit * 32 + CW
 
     def _set_T1_preset(self, axis, value):
         '''Set step period for tracking speed'''
-        logging.info(f'AXIS{axis}: Setting step_period to: {value} counts per seconds')
+        logging.info('AXIS%s: Setting step_period to: %s counts per seconds', axis, value)
         response = self._send_cmd('I', axis, value)
         return response
 
@@ -245,58 +294,101 @@ class motors(comm):
 
     def axis_set_goto_targetCounts(self, axis, targetCounts):
         '''GoTo Target value in StepsCounts. Motors has to be stopped'''
-        logging.info(f'AXIS{axis}: Setting goto target to {targetCounts} counts')
+        logging.info('AXIS%s: Setting goto target to %s counts', axis, targetCounts)
         # Position values are offseting by 0x800000
         response = self._send_cmd('S', axis, targetCounts + 0x800000)
         return response
 
+    def _axis_get_raw_status(self, axis):
+        '''Status msg. Reused for _STATUS_TTL seconds unless a set command is sent'''
+        now = time.monotonic()
+        cached = self._statusCache.get(axis)
+        if cached is not None and now - cached[0] < self._STATUS_TTL:
+            return cached[1]
+        status = self._send_cmd('f', axis)
+        self._statusCache[axis] = (now, status)
+        return status
+
+    def axis_get_status(self, axis):
+        '''Get decoded status. See _decode_status'''
+        return self._decode_status(self._axis_get_raw_status(axis))
+
+    def axis_is_running(self, axis):
+        '''Return True if axis is moving. Only the status msg is requested and decoded'''
+        status = self._axis_get_raw_status(axis)
+        # Status HEX digit2 B0: 1=Running,0=Stopped
+        return bool(status & 0x010)
+
+    def is_running(self):
+        '''Return True if any axis is moving'''
+        return self.axis_is_running(1) or self.axis_is_running(2)
+
+    def _ensure_stopped(self, axes):
+        '''Stop and wait for the running axes.
+        Motors may be moved by other clients, so a fresh status of all the axes
+        is asked (one pipelined round-trip) instead of trusting previous state'''
+        now = time.monotonic()
+        statuses = self._send_cmds([('f', axis) for axis in axes])
+        for axis, status in zip(axes, statuses):
+            self._statusCache[axis] = (now, status)
+        # Status HEX digit2 B0: 1=Running,0=Stopped
+        axes = [axis for axis, status in zip(axes, statuses) if status & 0x010]
+        if axes:
+            logging.info('Stopping axes %s', axes)
+            self._send_cmds([('K', axis) for axis in axes])
+            self._wait2stop(axes)
+
     def axis_wait2stop(self, axis):
-        logging.info(f'AXIS{axis}: Waitting to stop.')
+        self._wait2stop([axis])
         self.update_current_values()
-        while not self.values[axis]['Status']['Stopped']:
-            time.sleep(1)
-            self.update_current_values()
-        logging.info(f'AXIS{axis}: Stopped')
+
+    def _wait2stop(self, axes):
+        '''Wait for all the axes to stop. Callers refresh the values once afterwards'''
+        for axis in axes:
+            logging.info('AXIS%s: Waitting to stop.', axis)
+            while self.axis_is_running(axis):
+                time.sleep(1)
+            logging.info('AXIS%s: Stopped', axis)
 
     def axis_set_posCounts(self, axis, counts):
         '''Syncronize position Counts.'''
-        logging.info(f'AXIS{axis}: Syncronizing actual position to {counts} counts')
+        logging.info('AXIS%s: Syncronizing actual position to %s counts', axis, counts)
         # Position values are offseting by 0x800000
         response = self._send_cmd('E', axis, counts + 0x800000)
         return response
 
     def axis_set_goto_target(self, axis, targetDegrees):
         '''GoTo Target value in Degrees. Motors has to be stopped'''
-        logging.info(f'AXIS{axis}: Setting goto target to {targetDegrees} degrees')
+        logging.info('AXIS%s: Setting goto target to %s degrees', axis, targetDegrees)
         posCounts = self.degrees2counts(axis, targetDegrees)
         response = self.axis_set_goto_targetCounts(axis, int(posCounts))
         return response
 
     def axis_goto(self, axis, targetDegrees):
-        self.axis_stop_motion(axis)
+        self._ensure_stopped([axis])
         self.axis_set_motion_mode(axis, False, False, False)
         self.axis_set_goto_target(axis, targetDegrees)
         self.axis_start_motion(axis)
 
     def axis_set_speed(self, axis, degreesPerSecond):
         '''Set the tracking speed in degreesPerSecond'''
-        logging.info(f'AXIS{axis}: Setting speed to:{degreesPerSecond} degrees per second')
+        logging.info('AXIS%s: Setting speed to:%s degrees per second', axis, degreesPerSecond)
         if degreesPerSecond != 0:
             response = self._set_T1_preset(axis, int(self._degreesPerSecond2T1preset(axis, abs(degreesPerSecond))))
         else:
-            logging.info(f'AXIS{axis}: Requested speed==0. Stopping axis')
+            logging.info('AXIS%s: Requested speed==0. Stopping axis', axis)
             response = self.axis_stop_motion(axis)
         return response
 
     def axis_track(self, axis, speed):
         # Check if we need to stop axis
-        self.update_current_values(axis)
-        stopped = self.values[axis]['Status']['Stopped']
-        CW = not self.values[axis]['Status']['CCW']
-        tracking = self.values[axis]['Status']['Tracking']
+        status = self.axis_get_status(axis)
+        stopped = status['Stopped']
+        CW = not status['CCW']
+        tracking = status['Tracking']
         if not stopped:
             if not tracking or (CW and (speed < 0)) or (not CW and (speed > 0)):
-                logging.info(f'TRACK asked to change dir or mode tracking:{tracking} CW:{CW} speed:{speed}')
+                logging.info('TRACK asked to change dir or mode tracking:%s CW:%s speed:%s', tracking, CW, speed)
                 self.axis_stop_motion(axis, syncronous=True)
                 self.axis_set_motion_mode(axis, True, (speed < 0), False)
                 self.axis_set_speed(axis, speed)
@@ -313,31 +405,27 @@ class motors(comm):
     def axis_start_motion(self, axis):
         '''Start Goto'''
         response = self._send_cmd('J', axis)
-        logging.info(f'AXIS{axis}: Starting motion')
+        logging.info('AXIS%s: Starting motion', axis)
         return response
 
     def axis_stop_motion(self, axis, syncronous=True):
         '''Soft stop. If syncronous==True wait to finish'''
-        logging.info(f'AXIS{axis}: Stopping')
+        logging.info('AXIS%s: Stopping', axis)
         response = self._send_cmd('K', axis)
         if syncronous:
             self.axis_wait2stop(axis)
         else:
-            logging.info(f'AXIS{axis}: Ask to stop. In progress')
+            logging.info('AXIS%s: Ask to stop. In progress', axis)
         return response
 
     # HIGH LEVEL API (arguments in degrees)
     def degrees2counts(self, axis, degrees):
         '''Return position or speed in counts for a given deg or deg/seconds value'''
-        CPR = self.params[axis]['countsPerRevolution']
-        value = degrees * CPR / 360
-        return value
+        return degrees * self._countsPerDegree[axis]
 
     def counts2degrees(self, axis, counts):
         '''Return position or speed in degrees for a given counts or counts/seconds value'''
-        CPR = self.params[axis]['countsPerRevolution']
-        value = counts * 360 / CPR
-        return value
+        return counts * self._degreesPerCount[axis]
 
     def set_switch(self, on):
         '''Switch on/off auxiliary switch'''
@@ -345,32 +433,59 @@ class motors(comm):
             value = 1
         else:
             value = 0
-        logging.info(f'Auxiliary switch: {on}')
+        logging.info('Auxiliary switch: %s', on)
         response = self._send_cmd('O', 1, value, ndigits=1)
         return response
 
+    # BOTH AXES API. Commands for both axes are sent pipelined (one round-trip)
     def set_pos(self, alpha, beta):
         ''' Syncronize actual position with alpha and beta'''
-        self.axis_set_pos(1, alpha)
-        self.axis_set_pos(2, beta)
+        logging.info('Syncronizing actual position to axis1=%s axis2=%s degrees', alpha, beta)
+        # Position values are offseting by 0x800000
+        self._send_cmds([('E', axis, int(self.degrees2counts(axis, degrees)) + 0x800000)
+                         for axis, degrees in zip(AXES, (alpha, beta))])
+
+    def set_motion_mode(self, Tracking, CW=True, fastSpeed=False):
+        '''Set Motion Mode on both axes. See axis_set_motion_mode'''
+        value = self._motion_mode_value(Tracking, CW, fastSpeed)
+        logging.info('Setting Motion Mode: %s HEX:%02X', value, value)
+        return self._send_cmds([('G', axis, value, 2) for axis in AXES])
+
+    def set_goto_target(self, alpha, beta):
+        '''GoTo Target value in Degrees. Motors has to be stopped'''
+        logging.info('Setting goto target to axis1=%s axis2=%s degrees', alpha, beta)
+        # Position values are offseting by 0x800000
+        return self._send_cmds([('S', axis, int(self.degrees2counts(axis, degrees)) + 0x800000)
+                                for axis, degrees in zip(AXES, (alpha, beta))])
+
+    def start_motion(self):
+        '''Start both axes'''
+        logging.info('Starting motion')
+        return self._send_cmds([('J', axis) for axis in AXES])
+
+    def stop_motion(self, syncronous=True):
+        '''Soft stop both axes. If syncronous==True wait to finish'''
+        logging.info('Stopping')
+        response = self._send_cmds([('K', axis) for axis in AXES])
+        if syncronous:
+            self._wait2stop(AXES)
+            self.update_current_values()
+        return response
 
     def goto(self, alpha, beta, syncronous=False):
         '''GOTO. alpha,beta in degrees'''
-        logging.info(f'GOTO axis1={alpha} axis2={beta} degrees')
-        for axis in [1, 2]:
-            self.axis_stop_motion(axis)
-            self.axis_set_motion_mode(axis, False, False, False)
-        self.axis_set_goto_target(1, alpha)
-        self.axis_set_goto_target(2, beta)
-        for axis in [1, 2]:
-            self.axis_start_motion(axis)
+        logging.info('GOTO axis1=%s axis2=%s degrees', alpha, beta)
+        self._ensure_stopped(AXES)
+        self.set_motion_mode(False, False, False)
+        self.set_goto_target(alpha, beta)
+        self.start_motion()
         if syncronous:
-            for axis in [1, 2]:
-                self.axis_wait2stop(axis)
+            self._wait2stop(AXES)
+            self.update_current_values()
 
     def track(self, alpha, beta):
         '''GOTO. alpha,beta in degrees per second'''
-        logging.info(f'TRACK speeds axis1={alpha} axis2={beta} degrees per seconds')
+        logging.info('TRACK speeds axis1=%s axis2=%s degrees per seconds', alpha, beta)
         self.axis_track(1, alpha)
         self.axis_track(2, beta)
 
@@ -378,33 +493,28 @@ class motors(comm):
         '''Update current status and values
         logaxis can be 1,2,3 or None. 1 for only log current values of axis 1... 
         '''
-        parameterDict = {'GotoTarget': 'h',
-                         'Position': 'j',
-                         'StepPeriod': 'i',
-                         'Status': 'f'
-                         }
         try:
-            params = self.get_values(parameterDict)
+            params = self.get_values(self._CURRENT_VALUE_CMDS)
         except NameError as error:
             logging.warning(error)
             return {}
         for parameter in ['GotoTarget', 'Position']:
-            for axis in range(1, 3):
+            for axis in AXES:
                 # Position values are offseting by 0x800000
                 params[axis][parameter] = params[axis][parameter] - 0x800000
-        for axis in range(1, 3):
+        for axis in AXES:
             params[axis]['Status'] = self._decode_status(params[axis]['Status'])
         self.values = params
         if logaxis == 3:
-            logging.info(f'{params}')
-        if logaxis in [1, 2]:
-            logging.info(f'AXIS{logaxis} {params[logaxis]}')
+            logging.info('%s', params)
+        if logaxis in AXES:
+            logging.info('AXIS%s %s', logaxis, params[logaxis])
         return params
 
     # Methods for developing
     def _test_goto(self, axis=2, X=90):
         '''Test GOTO. X in degrees'''
-        logging.info(f'AXIS{axis}: GOTO test')
+        logging.info('AXIS%s: GOTO test', axis)
         self.axis_stop_motion(axis)
         self.axis_set_motion_mode(axis, False, X, False)
         self.axis_set_goto_target(axis, X)
@@ -413,52 +523,8 @@ class motors(comm):
 
     def _test_slew(self, axis=1, speed=1):
         '''Test SLEW'''
-        logging.info(f'AXIS{axis}: SLEW test')
+        logging.info('AXIS%s: SLEW test', axis)
         self.axis_stop_motion(axis)
         self.axis_set_motion_mode(axis, True, (speed >= 0), True)
         self.axis_set_speed(axis, speed)
         self.axis_start_motion(axis)
-
-
-if __name__ == '__main__':
-    smc = motors()
-    smc.set_pos(0, 0)
-    # AXIS to test
-    AXIS = 2
-
-    # Test GOTO
-    if True:
-        smc.test_goto(axis=AXIS, X=45)
-        smc.test_goto(axis=AXIS, X=0)
-        exit(0)
-
-    # Test SLEW
-    if False:
-        smc.test_slew(axis=AXIS, speed=.5)
-        smc.axis_wait2stop(AXIS)
-        exit(0)
-
-    # Two axes goto
-    if True:
-        smc.goto(5, 15)
-        smc.goto(0, 0)
-        exit(0)
-
-    # Ramp tracking
-    if False:
-        for speed in range(0, 50, 1):
-            time.sleep(.1)
-            smc.axis_track(AXIS, speed / 10)
-        for speed in range(50, 0, -1):
-            time.sleep(.1)
-            smc.axis_track(AXIS, speed / 10)
-        for speed in range(0, 50, 1):
-            time.sleep(.1)
-            smc.axis_track(AXIS, -speed / 10)
-        for speed in range(50, 0, -1):
-            time.sleep(.1)
-            smc.axis_track(AXIS, -speed / 10)
-        exit(0)
-    # GOTO/TRACK interrupts
-    if True:
-        pass
@@ -19,7 +19,7 @@ def goto(host, port,azimuth,altitude,wait):
     import synscan
     UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
     UDP_PORT = os.getenv("SYNSCAN_UDP_PORT",port)
-    smc=synscan.motors(UDP_IP,UDP_PORT)
+    smc=synscan.motors(UDP_IP,UDP_PORT,thread_safe=False)
     smc.goto(azimuth,altitude,syncronous=wait)
 
 
@@ -34,7 +34,7 @@ def track(host, port, azimuth_speed, altitude_speed):
     import synscan
     UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
     UDP_PORT = os.getenv("SYNSCAN_UDP_PORT",port)
-    smc=synscan.motors(UDP_IP,UDP_PORT)
+    smc=synscan.motors(UDP_IP,UDP_PORT,thread_safe=False)
     smc.track(azimuth_speed,altitude_speed)
 
 #STOP
@@ -47,9 +47,8 @@ def stop(host, port,wait):
     import synscan
     UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
     UDP_PORT = os.getenv("SYNSCAN_UDP_PORT",port)
-    smc=synscan.motors(UDP_IP,UDP_PORT)
-    smc.axis_stop_motion(1,syncronous=wait)
-    smc.axis_stop_motion(2,syncronous=wait)
+    smc=synscan.motors(UDP_IP,UDP_PORT,thread_safe=False)
+    smc.stop_motion(syncronous=wait)
 
 
 #SHOW
@@ -64,18 +63,26 @@ def watch(host, port,seconds):
     import time
     UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
     UDP_PORT = os.getenv("SYNSCAN_UDP_PORT",port)
-    smc=synscan.motors(UDP_IP,UDP_PORT)
+    smc=synscan.motors(UDP_IP,UDP_PORT,thread_safe=False)
+    period_ns=int(seconds*1e9)
+    next_ns=time.monotonic_ns()
     while True:
         response=smc.update_current_values(logaxis=3)
-        t = time.localtime()
-        response['TIME']=time.strftime("%H:%M:%S", t)
+        response['TIME']=time.strftime("%H:%M:%S")
         print(json.dumps(
             response,
             sort_keys=False,
             indent=4,
             separators=(',', ': ')
         ))
-        time.sleep(seconds)
+        #Sleep until next refresh so query time doesn't accumulate
+        next_ns+=period_ns
+        delay_ns=next_ns-time.monotonic_ns()
+        if delay_ns>0:
+            time.sleep(delay_ns/1e9)
+        else:
+            #Late (e.g. a slow response). Restart the schedule instead of bursting to catch up
+            next_ns=time.monotonic_ns()
 
 #SYNCRONIZE
 @click.command()
@@ -88,7 +95,7 @@ def syncronize(host, port,azimuth,altitude):
     import synscan
     UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
     UDP_PORT = os.getenv("SYNSCAN_UDP_PORT",port)
-    smc=synscan.motors(UDP_IP,UDP_PORT)
+    smc=synscan.motors(UDP_IP,UDP_PORT,thread_safe=False)
     smc.set_pos(azimuth,altitude)
 
 #Set On/off auxiliary switch
@@ -103,7 +110,7 @@ def switch(host, port, on,seconds):
     import time
     UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
     UDP_PORT = os.getenv("SYNSCAN_UDP_PORT",port)
-    smc=synscan.motors(UDP_IP,UDP_PORT)
+    smc=synscan.motors(UDP_IP,UDP_PORT,thread_safe=False)
     if seconds>0:
         smc.set_switch(on)
         time.sleep(seconds)
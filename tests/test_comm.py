@@ -0,0 +1,74 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+import pytest
+
+from synscan.comm import comm, ERROR_CODES
+
+
+@pytest.fixture
+def smc():
+    # No msg is sent. The socket is only created
+    smc = comm('127.0.0.1', 11880)
+    yield smc
+    smc.close()
+
+
+@pytest.mark.parametrize('synscanHex,value,ndigits', [
+    ('1FCA89', 0x89CA1F, 6),
+    ('563412', 0x123456, 6),
+    ('000080', 0x800000, 6),
+    ('5F3A', 0x3A5F, 4),
+    ('3412', 0x1234, 4),
+    ('B8', 0xB8, 2),
+    ('12', 0x12, 2),
+])
+def test_hex_round_trip(smc, synscanHex, value, ndigits):
+    assert smc._hex2int(synscanHex.encode()) == value
+    assert smc._hex2int(memoryview(synscanHex.encode())) == value
+    assert smc._int2hex(value, ndigits) == synscanHex
+
+
+def test_int2hex_special_cases(smc):
+    assert smc._int2hex(None, 0) == ''
+    assert smc._int2hex(7, 1) == '7'
+
+
+def test_status_is_kept_in_digit_order(smc):
+    assert smc._hex2int(b'ABC') == 0xABC
+    assert smc._hex2int(b'101') == 0x101
+
+
+def test_empty_data(smc):
+    assert smc._hex2int(b'') is None
+
+
+def test_parse_ack_without_data(smc):
+    assert smc._parse_response(b':J1\r', b'=\r') is None
+
+
+def test_parse_data(smc):
+    assert smc._parse_response(b':j1\r', b'=563412\r') == 0x123456
+    assert smc._parse_response(b':f1\r', b'=101\r') == 0x101
+
+
+@pytest.mark.parametrize('errorNumber', sorted(ERROR_CODES))
+def test_parse_error_codes(smc, errorNumber):
+    with pytest.raises(NameError, match=f'^{ERROR_CODES[errorNumber]}$'):
+        smc._parse_response(b':G1\r', f'!{errorNumber:X}\r'.encode())
+
+
+def test_parse_unknown_errors(smc):
+    with pytest.raises(NameError, match='^CMDUnknowError$'):
+        smc._parse_response(b':G1\r', b'!6\r')
+    with pytest.raises(NameError, match='^CMDUnknowError$'):
+        smc._parse_response(b':G1\r', b'?\r')
+
+
+def test_build_cmd(smc):
+    assert smc._build_cmd('j', 1) == b':j1\r'
+    assert smc._build_cmd('S', 2, 0x123456) == b':S2563412\r'
+    assert smc._build_cmd('G', 1, 0x30, 2) == b':G130\r'
+    assert smc._build_cmd('O', 1, 1, 1) == b':O11\r'
@@ -0,0 +1,36 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+from synscan.motors import motors
+
+
+def decode_status_reference(hexstring):
+    '''Original decoder working on the status msg string "ABC"'''
+    A = int(hexstring[0], 16)
+    B = int(hexstring[1], 16)
+    C = int(hexstring[2], 16)
+    status = dict()
+    status['Tracking'] = bool(A & 0x01)
+    status['CCW'] = bool((A & 0x02) >> 1)
+    status['FastSpeed'] = bool((A & 0x04) >> 2)
+    status['Stopped'] = not (B & 0x01)
+    status['Blocked'] = bool((B & 0x02) >> 1)
+    status['InitDone'] = not (C & 0x01)
+    status['LevelSwitchOn'] = bool((B & 0x02) >> 1)
+    return status
+
+
+def test_decode_status_matches_reference():
+    # Not connected. _decode_status does not use the mount
+    smc = motors.__new__(motors)
+    for status in range(0x1000):
+        assert smc._decode_status(status) == decode_status_reference(f'{status:03X}')
+
+
+def test_decode_status_returns_own_dict():
+    smc = motors.__new__(motors)
+    status = smc._decode_status(0x101)
+    status['Stopped'] = None
+    assert smc._decode_status(0x101)['Stopped'] is True